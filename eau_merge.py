@@ -1,7 +1,9 @@
 import pandas as pd
 import geopandas as gpd
 import matplotlib.pyplot as plt
+from matplotlib.patches import Patch
 from typing import List
+from imputation import NeighbourImputer, drop_imputed
 
 class DataProcessor:
     def __init__(self, water_files: List[str], geojson_path: str, rent_data: pd.DataFrame):
@@ -55,6 +57,14 @@ class DataProcessor:
         rent_agg = self.rent_data.groupby("INSEE_C")["loypredm2"].mean().reset_index()
         self.geo_data = self.geo_data.merge(rent_agg, left_on="codgeo", right_on="INSEE_C", how="left")
 
+    def impute_missing_data(self, k: int = 5):
+        """Imputer les communes sans mesure à partir des k communes voisines (KD-tree sur les centroïdes)."""
+        imputer = NeighbourImputer(self.geo_data, k=k)
+        self.geo_data = imputer.impute(
+            self.geo_data,
+            ["bacterio_conformity", "chemical_conformity", "loypredm2"]
+        )
+
     def plot_water_quality(self, column: str, title: str):
         """Tracer la qualité de l'eau sur une carte."""
         fig, ax = plt.subplots(1, 1, figsize=(12, 10))
@@ -65,13 +75,29 @@ class DataProcessor:
             missing_kwds={"color": "red", "label": "Données manquantes"},
             ax=ax
         )
+        # Hachurer les communes dont la valeur a été imputée depuis leurs voisines
+        flag = f"{column}_imputed"
+        if flag in self.geo_data.columns and self.geo_data[flag].any():
+            self.geo_data[self.geo_data[flag].astype(bool)].plot(
+                ax=ax, facecolor="none", edgecolor="dimgrey", hatch="///", linewidth=0
+            )
+            ax.legend(
+                handles=[Patch(facecolor="none", edgecolor="dimgrey", hatch="///", label="Valeurs imputées")],
+                loc="lower left"
+            )
         plt.title(title)
         plt.axis("off")
         plt.show()
 
-    def analyze_correlation(self):
-        """Analyser les corrélations entre la qualité de l'eau, les loyers et d'autres variables."""
-        analysis_data = self.geo_data[["bacterio_conformity", "chemical_conformity", "loypredm2"]].dropna()
+    def analyze_correlation(self, exclude_imputed: bool = False):
+        """
+        Analyser les corrélations entre la qualité de l'eau, les loyers et d'autres variables.
+
+        :param exclude_imputed: Ne garder que les communes dont aucune valeur n'a été imputée.
+        """
+        columns = ["bacterio_conformity", "chemical_conformity", "loypredm2"]
+        analysis_data = drop_imputed(self.geo_data, columns) if exclude_imputed else self.geo_data
+        analysis_data = analysis_data[columns].dropna()
         correlation_matrix = analysis_data.corr()
         print("Matrice de corrélation :")
         print(correlation_matrix)
@@ -87,5 +113,6 @@ if __name__ == "__main__":
     processor.clean_water_data()
     processor.load_geo_data()
     processor.merge_data()
+    processor.impute_missing_data()
     processor.plot_water_quality("bacterio_conformity", "Conformité Bactériologique de l'Eau")
-    processor.analyze_correlation()
+    processor.analyze_correlation(exclude_imputed=True)
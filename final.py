@@ -1,8 +1,11 @@
 import pandas as pd
 import geopandas as gpd
 import matplotlib.pyplot as plt
+from matplotlib.patches import Patch
 import seaborn as sns
 from typing import List
+from raster_map import RasterMapRenderer
+from imputation import NeighbourImputer, drop_imputed
 
 class DataProcessor:
     def __init__(
@@ -33,6 +36,7 @@ class DataProcessor:
         self.water_data = None
         self.pop_data = None
         self.rent_data = None
+        self.raster_renderer = None
 
     def load_water_data(self):
         """Charger et concaténer les données sur la qualité de l'eau."""
@@ -110,6 +114,18 @@ class DataProcessor:
                 how="left"
             )
 
+    def impute_missing_data(self, k: int = 5):
+        """Imputer les communes sans mesure à partir des k communes voisines (KD-tree sur les centroïdes)."""
+        imputer = NeighbourImputer(
+            self.geo_data,
+            k=k,
+            weight_column="p21_pop" if "p21_pop" in self.geo_data.columns else None
+        )
+        self.geo_data = imputer.impute(
+            self.geo_data,
+            ["bacterio_conformity", "chemical_conformity", "mean_loypredm2"]
+        )
+
     def plot_map(self, column: str, title: str, filename: str, cmap="Blues"):
         """Tracer et sauvegarder une carte."""
         fig, ax = plt.subplots(1, 1, figsize=(12, 10))
@@ -120,18 +136,39 @@ class DataProcessor:
             missing_kwds={"color": "lightgrey", "label": "Données manquantes"},
             ax=ax
         )
+        # Hachurer les communes dont la valeur a été imputée depuis leurs voisines
+        flag = f"{column}_imputed"
+        if flag in self.geo_data.columns and self.geo_data[flag].any():
+            self.geo_data[self.geo_data[flag].astype(bool)].plot(
+                ax=ax, facecolor="none", edgecolor="dimgrey", hatch="///", linewidth=0
+            )
+            ax.legend(
+                handles=[Patch(facecolor="none", edgecolor="dimgrey", hatch="///", label="Valeurs imputées")],
+                loc="lower left"
+            )
         plt.title(title)
         plt.axis("off")
         plt.savefig(f"{self.output_dir}/{filename}.png", dpi=300)
         plt.close()
 
-    def plot_correlation_heatmap(self):
-        """Tracer une heatmap des corrélations."""
+    def plot_raster_map(self, column: str, filename: str, cmap="Blues", width: int = 2000):
+        """Tracer une carte via la grille de labels pré-rastérisée (sans redessiner les polygones)."""
+        if self.raster_renderer is None or self.raster_renderer.width != width:
+            self.raster_renderer = RasterMapRenderer(self.geo_data, width=width)
+        self.raster_renderer.render(self.geo_data, column, f"{self.output_dir}/{filename}.png", cmap=cmap)
+
+    def plot_correlation_heatmap(self, exclude_imputed: bool = False):
+        """
+        Tracer une heatmap des corrélations.
+
+        :param exclude_imputed: Ne garder que les communes dont aucune valeur n'a été imputée.
+        """
         columns = ["bacterio_conformity", "chemical_conformity", "mean_loypredm2"]
         if self.pop_data is not None and "p21_pop" in self.geo_data.columns:
             columns.append("p21_pop")
 
-        analysis_data = self.geo_data[columns].dropna()
+        analysis_data = drop_imputed(self.geo_data, columns) if exclude_imputed else self.geo_data
+        analysis_data = analysis_data[columns].dropna()
         correlation_matrix = analysis_data.corr()
 
         plt.figure(figsize=(8, 6))
@@ -179,6 +216,7 @@ if __name__ == "__main__":
     processor.load_rent_data()
     processor.load_population_data()
     processor.merge_data()
+    processor.impute_missing_data()
 
     # Générer les visualisations
     processor.plot_map("bacterio_conformity", "Conformité Bactériologique", "bacterio_conformity")
@@ -188,4 +226,4 @@ if __name__ == "__main__":
         processor.plot_map("p21_pop", "Population Municipale (2021)", "population", cmap="Greens")
 
     # Générer la heatmap des corrélations
-    processor.plot_correlation_heatmap()
+    processor.plot_correlation_heatmap(exclude_imputed=True)
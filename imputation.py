@@ -0,0 +1,103 @@
+import numpy as np
+import pandas as pd
+import geopandas as gpd
+from scipy.spatial import cKDTree
+from typing import List
+
+
+class NeighbourImputer:
+    def __init__(
+        self,
+        geo_data: gpd.GeoDataFrame,
+        k: int = 5,
+        weight_column: str = None,
+        metric_crs: str = "EPSG:2154"
+    ):
+        """
+        Imputation des communes sans mesure à partir de leurs plus proches voisines.
+
+        Les centroïdes sont calculés une seule fois ; un KD-tree est construit sur les communes
+        ayant une donnée (un seul arbre par ensemble de communes renseignées, partagé entre
+        colonnes), ce qui garantit k voisines valides même au milieu d'une grande zone vide.
+        Les valeurs manquantes sont remplacées par la moyenne pondérée (inverse de la distance,
+        multipliée par la population si disponible) de ces k voisines. Toutes les communes
+        manquantes d'une colonne sont traitées en une requête vectorisée.
+
+        :param geo_data: GeoDataFrame des communes, dans le même ordre que les données à imputer.
+        :param k: Nombre de voisines avec donnée utilisées pour chaque commune.
+        :param weight_column: Colonne de population pour pondérer les voisines (optionnelle).
+        :param metric_crs: Projection métrique utilisée pour les distances (Lambert-93 par défaut).
+        """
+        self.k = k
+        centroids = geo_data.geometry.to_crs(metric_crs).centroid if geo_data.crs else geo_data.geometry.centroid
+        self.points = np.column_stack([centroids.x.to_numpy(), centroids.y.to_numpy()])
+        self._donor_trees = {}
+
+        if weight_column and weight_column in geo_data.columns:
+            weights = pd.to_numeric(geo_data[weight_column], errors="coerce")
+            self.weights = weights.fillna(weights.median()).fillna(1.0).to_numpy(dtype=float)
+        else:
+            self.weights = np.ones(len(geo_data))
+
+    def _donor_tree(self, has_data: np.ndarray) -> cKDTree:
+        """KD-tree des communes renseignées, mis en cache par masque (eau bactério/chimique le partagent)."""
+        key = np.packbits(has_data).tobytes()
+        if key not in self._donor_trees:
+            self._donor_trees[key] = cKDTree(self.points[has_data])
+        return self._donor_trees[key]
+
+    def _impute_column(self, values: np.ndarray) -> np.ndarray:
+        """Remplir les NaN d'un vecteur aligné sur les centroïdes."""
+        has_data = ~np.isnan(values)
+        missing = np.flatnonzero(~has_data)
+        if missing.size == 0 or not has_data.any():
+            return values
+
+        # L'arbre ne contient que des communes renseignées : chaque voisine est valide
+        donors = np.flatnonzero(has_data)
+        k = min(self.k, donors.size)
+        distances, positions = self._donor_tree(has_data).query(self.points[missing], k=k)
+        distances = distances.reshape(len(missing), -1)
+        neighbours = donors[positions.reshape(len(missing), -1)]
+
+        weights = self.weights[neighbours] / np.maximum(distances, 1.0)
+        neighbour_values = values[neighbours]
+        total = weights.sum(axis=1)
+
+        filled = values.copy()
+        with np.errstate(invalid="ignore", divide="ignore"):
+            filled[missing] = np.where(
+                total > 0,
+                (weights * neighbour_values).sum(axis=1) / total,
+                neighbour_values.mean(axis=1)
+            )
+        return filled
+
+    def impute(self, data: pd.DataFrame, columns: List[str]) -> pd.DataFrame:
+        """
+        Imputer les colonnes demandées et ajouter une colonne booléenne `<colonne>_imputed`.
+
+        :param data: DataFrame aligné ligne à ligne sur le GeoDataFrame du constructeur.
+        :param columns: Colonnes à imputer.
+        :return: Copie de `data` avec les valeurs manquantes remplies.
+        """
+        if len(data) != len(self.points):
+            raise ValueError("Les données doivent être alignées sur les communes de l'imputeur.")
+
+        data = data.copy()
+        for column in columns:
+            if column not in data.columns:
+                continue
+            values = pd.to_numeric(data[column], errors="coerce").to_numpy(dtype=float)
+            filled = self._impute_column(values)
+            data[f"{column}_imputed"] = np.isnan(values) & ~np.isnan(filled)
+            data[column] = filled
+        return data
+
+
+def drop_imputed(data: pd.DataFrame, columns: List[str]) -> pd.DataFrame:
+    """Retirer les lignes dont au moins une des colonnes a été imputée (drapeau `<colonne>_imputed`)."""
+    flags = [f"{column}_imputed" for column in columns if f"{column}_imputed" in data.columns]
+    if not flags:
+        return data
+    return data[~data[flags].fillna(False).astype(bool).any(axis=1)]
@@ -1,15 +1,37 @@
+import os
+import glob
+import queue
+import hashlib
+import threading
 import pandas as pd
 import geopandas as gpd
-from sqlalchemy import create_engine, text
+from sqlalchemy import create_engine, text, Integer, String, Text
 import chardet
 import folium
 import matplotlib.pyplot as plt
+from raster_map import RasterMapRenderer
+
+WATER_REQUIRED_COLUMNS = [
+    "inseecommune",
+    "plvconformitebacterio",
+    "plvconformitechimique",
+    "bacterio_conformity",
+    "chemical_conformity",
+]
 
 # crashes when i run on my laptop, i think it's because of the memory, connexion to the database is established but the data is not loaded.. debugged 
 class MySQLWaterRentProcessor:
-    def __init__(self, host, user, password, database):
+    def __init__(self, host, user, password, database, pool_size: int = 5, cache_dir: str = "cache"):
         self.database = database
-        self.engine = create_engine(f"mysql+mysqlconnector://{user}:{password}@{host}/{database}")
+        self.cache_dir = cache_dir
+        # Pooled connections: repeated reads reuse sockets instead of reconnecting
+        self.engine = create_engine(
+            f"mysql+mysqlconnector://{user}:{password}@{host}/{database}",
+            pool_size=pool_size,
+            max_overflow=pool_size,
+            pool_pre_ping=True,
+            pool_recycle=3600
+        )
 
     def create_schema(self):
         schema_sql = f"""
@@ -122,6 +144,180 @@ class MySQLWaterRentProcessor:
         water_df.to_sql("water_data", con=self.engine, if_exists="replace", index=False)
         print("Water data saved to 'water_data' table.")
 
+    def _water_schema(self, water_files: list) -> list:
+        """
+        Union of the columns of every water file (header only), plus the derived conformity columns.
+        PLV and RES files do not share the same columns, so the table is built from all of them.
+        """
+        columns = {}
+        for file in water_files:
+            header = pd.read_csv(file, delimiter=",", encoding="ISO-8859-1", nrows=0)
+            columns.update(dict.fromkeys(header.columns))
+        columns.update(dict.fromkeys(WATER_REQUIRED_COLUMNS))
+        return list(columns)
+
+    def _create_water_table(self, columns: list):
+        """Create an empty 'water_data' with fixed column types, so every chunk can be appended."""
+        dtypes = {column: Text() for column in columns}
+        dtypes["inseecommune"] = String(5)
+        dtypes["bacterio_conformity"] = Integer()
+        dtypes["chemical_conformity"] = Integer()
+        pd.DataFrame(columns=columns).to_sql(
+            "water_data", con=self.engine, if_exists="replace", index=False, dtype=dtypes
+        )
+
+    def _water_chunks(self, water_files: list, columns: list, chunksize: int):
+        """Yield cleaned water chunks, all reindexed to the same column set."""
+        raw_columns = [c for c in columns if c not in ("bacterio_conformity", "chemical_conformity")]
+        for file in water_files:
+            with pd.read_csv(file, delimiter=",", encoding="ISO-8859-1", dtype=str, chunksize=chunksize) as reader:
+                for chunk in reader:
+                    chunk = chunk.reindex(columns=raw_columns)
+                    # Rows without a commune code cannot reference 'commune'
+                    chunk = chunk.dropna(subset=["inseecommune"])
+                    if chunk.empty:
+                        continue
+                    chunk["inseecommune"] = chunk["inseecommune"].astype(str).str.zfill(5)
+                    chunk["bacterio_conformity"] = (chunk["plvconformitebacterio"] == "C").astype(int)
+                    chunk["chemical_conformity"] = (chunk["plvconformitechimique"] == "C").astype(int)
+                    yield chunk[columns]
+
+    def _rent_chunks(self, rent_files: list, chunksize: int):
+        """Yield rent chunks reduced to the commune code and the predicted rent."""
+        for file in rent_files:
+            encoding = self.detect_encoding(file)
+            with pd.read_csv(
+                file, sep=";", decimal=",", encoding=encoding,
+                usecols=["INSEE_C", "loypredm2"], dtype={"INSEE_C": str}, chunksize=chunksize
+            ) as reader:
+                for chunk in reader:
+                    chunk = chunk.dropna(subset=["INSEE_C"])
+                    if chunk.empty:
+                        continue
+                    chunk["INSEE_C"] = chunk["INSEE_C"].astype(str).str.zfill(5)
+                    yield chunk
+
+    @staticmethod
+    def _put_unless_stopped(out: queue.Queue, item, stop: threading.Event) -> bool:
+        """Put into the bounded queue, giving up as soon as the consumer asks to stop."""
+        while not stop.is_set():
+            try:
+                out.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def _produce_chunks(
+        self, water_files: list, rent_files: list, columns: list,
+        chunksize: int, out: queue.Queue, stop: threading.Event
+    ):
+        """
+        Producer side of load_pipelined: parse every file exactly once, in chunks.
+        Water and rent files are read round-robin so the writer always has work queued:
+        water chunks are queued as-is, rent chunks queue their commune codes and are
+        reduced to running sums/counts, the rent means being queued once at the end.
+        """
+        sources = [
+            ("water", self._water_chunks(water_files, columns, chunksize)),
+            ("rent", self._rent_chunks(rent_files, chunksize)),
+        ]
+        try:
+            rent_sum, rent_count = None, None
+            while sources and not stop.is_set():
+                for source in list(sources):
+                    kind, chunks = source
+                    chunk = next(chunks, None)
+                    if chunk is None:
+                        sources.remove(source)
+                    elif kind == "water":
+                        self._put_unless_stopped(out, ("water", chunk), stop)
+                    else:
+                        grouped = chunk.groupby("INSEE_C")["loypredm2"]
+                        chunk_sum, chunk_count = grouped.sum(), grouped.count()
+                        rent_sum = chunk_sum if rent_sum is None else rent_sum.add(chunk_sum, fill_value=0)
+                        rent_count = chunk_count if rent_count is None else rent_count.add(chunk_count, fill_value=0)
+                        self._put_unless_stopped(out, ("communes", chunk_sum.index), stop)
+
+            if rent_sum is not None and not stop.is_set():
+                rent_avg = (rent_sum / rent_count.where(rent_count > 0)).rename("mean_loypredm2")
+                rent_avg = rent_avg.rename_axis("insee_c").reset_index()
+                self._put_unless_stopped(out, ("rent", rent_avg), stop)
+        except Exception as exc:
+            self._put_unless_stopped(out, ("error", exc), stop)
+        finally:
+            # Closing the generators closes the underlying CSV readers
+            for _, chunks in sources:
+                chunks.close()
+            self._put_unless_stopped(out, None, stop)
+
+    def _insert_new_communes(self, conn, codgeos, seen: set):
+        """Insert stubs for commune codes not seen yet in this load, ignoring existing rows."""
+        new_codes = set(codgeos) - seen
+        if new_codes:
+            conn.execute(
+                text("INSERT IGNORE INTO commune (codgeo) VALUES (:codgeo)"),
+                [{"codgeo": code} for code in new_codes]
+            )
+            seen.update(new_codes)
+
+    def load_pipelined(self, water_files: list, rent_files: list, chunksize: int = 100_000, queue_size: int = 4):
+        """
+        Load water and rent data with parsing and database writes overlapped.
+
+        A producer thread parses the files in chunks into a bounded queue while this thread
+        writes each chunk to MySQL. Commune stubs are collected from the same pass and
+        inserted just before the rows that reference them, so each file is read only once
+        (replaces populate_commune_stub + load_rent_data + load_water_data).
+        'water_data' is created up front from the union of all file headers, then only appended to.
+        """
+        columns = self._water_schema(water_files)
+        self._create_water_table(columns)
+
+        chunks = queue.Queue(maxsize=queue_size)
+        stop = threading.Event()
+        producer = threading.Thread(
+            target=self._produce_chunks,
+            args=(water_files, rent_files, columns, chunksize, chunks, stop),
+            daemon=True
+        )
+        producer.start()
+
+        seen_communes = set()
+        error = None
+        try:
+            while True:
+                item = chunks.get()
+                if item is None:
+                    break
+                kind, payload = item
+                if kind == "error":
+                    error = payload
+                    continue
+
+                with self.engine.begin() as conn:
+                    if kind == "water":
+                        self._insert_new_communes(conn, payload["inseecommune"].unique(), seen_communes)
+                        payload.to_sql("water_data", con=conn, if_exists="append", index=False)
+                    elif kind == "communes":
+                        self._insert_new_communes(conn, payload, seen_communes)
+                    elif kind == "rent":
+                        self._insert_new_communes(conn, payload["insee_c"].unique(), seen_communes)
+                        payload.to_sql("rent_data", con=conn, if_exists="replace", index=False)
+        finally:
+            # On a write failure, unblock the producer and let it close its files before re-raising
+            stop.set()
+            while producer.is_alive():
+                try:
+                    chunks.get(timeout=0.1)
+                except queue.Empty:
+                    pass
+            producer.join()
+
+        if error is not None:
+            raise error
+        print(f"Pipelined load done: {len(seen_communes)} communes, water and rent tables written.")
+
     def preprocess_and_merge_data(self):
         """
         Aggregate water_data -> insert into merged_data, then join rent_data for the rent info.
@@ -149,6 +345,76 @@ class MySQLWaterRentProcessor:
 
         print("Merged data has been populated in 'merged_data' table.")
 
+    def _merged_data_version(self, conn) -> str:
+        count, max_id = conn.execute(text("SELECT COUNT(*), MAX(id) FROM merged_data")).one()
+        update_time = conn.execute(text("""
+            SELECT UPDATE_TIME FROM information_schema.tables
+            WHERE table_schema = :schema AND table_name = 'merged_data'
+        """), {"schema": self.database}).scalar()
+        return hashlib.md5(f"{count}-{max_id}-{update_time}".encode()).hexdigest()[:12]
+
+    def merged_data_version(self) -> str:
+        """
+        Cheap version tag for merged_data: row count, max id and last update time.
+        preprocess_and_merge_data re-inserts every row, so MAX(id) moves on each rebuild.
+        """
+        with self.engine.connect() as conn:
+            return self._merged_data_version(conn)
+
+    def fetch_merged_data(self, department: str = None, chunksize: int = 50_000) -> pd.DataFrame:
+        """
+        Read merged_data (optionally one department) page by page, using keyset pagination on id.
+        mysqlconnector buffers every result set client-side, so each page is a bounded query
+        (WHERE id > last ORDER BY id LIMIT n) rather than one big streamed SELECT.
+        Results are cached locally per table version, so unchanged data is never re-queried.
+        """
+        numeric_columns = ["bacterio_conformity", "chemical_conformity", "mean_loypredm2"]
+        query = """
+            SELECT id, insee_commune, bacterio_conformity, chemical_conformity, mean_loypredm2
+            FROM merged_data
+            WHERE id > :last_id
+        """
+        params = {"chunksize": chunksize}
+        if department:
+            query += " AND insee_commune LIKE :prefix"
+            params["prefix"] = f"{department}%"
+        query += " ORDER BY id LIMIT :chunksize"
+
+        chunks = []
+        # One transaction: InnoDB serves the version check and every page from the same snapshot
+        with self.engine.begin() as conn:
+            version = self._merged_data_version(conn)
+            cache_name = f"merged_data_{department or 'all'}_{version}.pkl"
+            cache_path = os.path.join(self.cache_dir, cache_name)
+            if os.path.exists(cache_path):
+                return pd.read_pickle(cache_path)
+
+            last_id = 0
+            while True:
+                chunk = pd.read_sql(text(query), conn, params={**params, "last_id": last_id})
+                if chunk.empty:
+                    break
+                last_id = int(chunk["id"].iloc[-1])
+                # DECIMAL columns arrive as Python Decimal objects; downcast per page
+                chunk[numeric_columns] = chunk[numeric_columns].apply(pd.to_numeric, downcast="float")
+                chunks.append(chunk.drop(columns="id"))
+                if len(chunk) < chunksize:
+                    break
+
+        if chunks:
+            merged = pd.concat(chunks, ignore_index=True)
+        else:
+            merged = pd.DataFrame(columns=["insee_commune", *numeric_columns])
+
+        os.makedirs(self.cache_dir, exist_ok=True)
+        # Older versions of the same selection are never read again
+        for stale in glob.glob(os.path.join(self.cache_dir, f"merged_data_{department or 'all'}_*.pkl")):
+            if os.path.basename(stale) != cache_name:
+                os.remove(stale)
+        merged.to_pickle(cache_path)
+        print(f"Fetched {len(merged)} rows from 'merged_data' (version {version}).")
+        return merged
+
 
 class GeoDataVisualizer:
     """
@@ -156,6 +422,26 @@ class GeoDataVisualizer:
     """
     def __init__(self, geojson_path: str):
         self.geo_data = gpd.read_file(geojson_path)
+        self.geo_data["codgeo"] = self.geo_data["codgeo"].astype(str).str.zfill(5)
+        # Untouched geometry: every join starts from it, so filtering never loses communes
+        self._base_geo = self.geo_data
+        self._department = None
+        self.raster_renderer = None
+
+    def join_merged_data(self, merged: pd.DataFrame, department: str = None):
+        """
+        Attach merged_data rows (see MySQLWaterRentProcessor.fetch_merged_data) to the geometry
+        by commune code. With a department, only that department's communes are kept.
+        """
+        geo_data = self._base_geo
+        if department:
+            geo_data = geo_data[geo_data["codgeo"].str.startswith(department)]
+        if department != self._department:
+            self.raster_renderer = None
+            self._department = department
+
+        merged = merged.assign(insee_commune=merged["insee_commune"].astype(str).str.zfill(5))
+        self.geo_data = geo_data.merge(merged, left_on="codgeo", right_on="insee_commune", how="left")
 
     def visualize_static_map(self, column: str, title: str, output_path: str):
         fig, ax = plt.subplots(1, 1, figsize=(12, 10))
@@ -171,6 +457,12 @@ class GeoDataVisualizer:
         plt.savefig(output_path)
         plt.show()
 
+    def visualize_raster_map(self, column: str, output_path: str, width: int = 2000):
+        """Fast choropleth: rasterize communes once (cached on disk), then colour pixels by lookup."""
+        if self.raster_renderer is None or self.raster_renderer.width != width:
+            self.raster_renderer = RasterMapRenderer(self.geo_data, width=width)
+        self.raster_renderer.render(self.geo_data, column, output_path, cmap="YlOrRd", missing_color="blue")
+
     def visualize_interactive_map(self, column: str, output_path: str):
         m = folium.Map(location=[46.603354, 1.888334], zoom_start=6)
         folium.Choropleth(
@@ -219,36 +511,21 @@ if __name__ == "__main__":
     processor.create_schema()
     
 
-    all_water = pd.concat([pd.read_csv(f, delimiter=",", encoding="ISO-8859-1") for f in water_files])
-    all_water["inseecommune"] = all_water["inseecommune"].astype(str).str.zfill(5)
-    codgeo_water = set(all_water["inseecommune"].unique())
-
-    all_rent = pd.concat([
-        pd.read_csv(f, sep=";", decimal=",", encoding=processor.detect_encoding(f)) 
-        for f in rent_files
-    ])
-    all_rent["INSEE_C"] = all_rent["INSEE_C"].astype(str).str.zfill(5)
-    codgeo_rent = set(all_rent["INSEE_C"].unique())
-
-    all_codgeos = codgeo_water.union(codgeo_rent)
-    # Insert them into 'commune'
-    processor.populate_commune_stub(all_codgeos)
-
-    # Now load data normally
-    processor.load_rent_data(rent_files)
-    processor.load_water_data(water_files)
+    # Parse each file once; commune stubs and database writes happen in the same pass
+    processor.load_pipelined(water_files, rent_files)
 
     # Merge
     processor.preprocess_and_merge_data()
 
     # Visualization from local geojson
     visualizer = GeoDataVisualizer(geojson_path)
+    visualizer.join_merged_data(processor.fetch_merged_data())
     visualizer.visualize_static_map(
-        column="codgeo",
-        title="Communes by codgeo",
+        column="mean_loypredm2",
+        title="Mean rent per commune (from merged_data)",
         output_path="static_map.png"
     )
     visualizer.visualize_interactive_map(
-        column="codgeo",
+        column="mean_loypredm2",
         output_path="interactive_map.html"
     )
@@ -0,0 +1,184 @@
+import os
+import hashlib
+import numpy as np
+import pandas as pd
+import geopandas as gpd
+import matplotlib.pyplot as plt
+from matplotlib.colors import Normalize, to_rgba
+import shapely
+
+
+# À incrémenter quand la rastérisation change : les anciennes grilles ne sont plus relues
+LABELS_FORMAT_VERSION = 2
+
+
+class RasterMapRenderer:
+    def __init__(
+        self,
+        geo_data: gpd.GeoDataFrame,
+        code_column: str = "codgeo",
+        width: int = 2000,
+        cache_dir: str = "cache"
+    ):
+        """
+        Rendu rapide de cartes choroplèthes à partir d'une grille de labels pré-rastérisée.
+
+        Les polygones des communes sont rastérisés une seule fois en une grille d'entiers
+        (un identifiant de commune par pixel, -1 hors commune), mise en cache sur disque
+        pour chaque résolution. Chaque nouvelle carte est ensuite une simple indexation
+        NumPy des valeurs par label, écrite directement en PNG.
+
+        :param geo_data: GeoDataFrame des communes (géométries + code commune).
+        :param code_column: Colonne contenant le code commune.
+        :param width: Largeur de l'image en pixels (la hauteur est déduite de l'emprise).
+        :param cache_dir: Répertoire où sauvegarder les grilles de labels.
+        """
+        geo_data = geo_data.drop_duplicates(subset=code_column)
+        self.code_column = code_column
+        self.codes = geo_data[code_column].astype(str).str.zfill(5).to_numpy()
+        self.geometries = geo_data.geometry.to_numpy()
+        self.width = width
+        self.cache_dir = cache_dir
+
+        self.crs = geo_data.crs.to_string() if geo_data.crs is not None else ""
+        self.bounds = tuple(float(b) for b in geo_data.total_bounds)
+        minx, miny, maxx, maxy = self.bounds
+        self.dx = (maxx - minx) / width
+        # Même correction d'aspect que geopandas pour les coordonnées géographiques
+        if geo_data.crs is not None and geo_data.crs.is_geographic:
+            self.dy = self.dx * np.cos(np.radians((miny + maxy) / 2))
+        else:
+            self.dy = self.dx
+        self.height = int(np.ceil((maxy - miny) / self.dy))
+
+        self.labels = None
+
+    def _cache_path(self) -> str:
+        # La clé couvre l'emprise, la projection et le découpage communal, pas seulement la taille
+        key = hashlib.md5()
+        key.update(str(LABELS_FORMAT_VERSION).encode())
+        key.update(repr(self.bounds).encode())
+        key.update(self.crs.encode())
+        key.update("\n".join(self.codes.astype(str)).encode())
+        return os.path.join(
+            self.cache_dir, f"labels_{self.width}x{self.height}_{key.hexdigest()[:12]}.npz"
+        )
+
+    def _rasterize(self) -> np.ndarray:
+        """Rastériser chaque polygone dans sa boîte englobante (une seule fois)."""
+        minx, miny, maxx, maxy = self.bounds
+        labels = np.full((self.height, self.width), -1, dtype=np.int32)
+        xs = minx + (np.arange(self.width) + 0.5) * self.dx
+        ys = maxy - (np.arange(self.height) + 0.5) * self.dy
+
+        for label, geom in enumerate(self.geometries):
+            if geom is None or geom.is_empty:
+                continue
+            gx0, gy0, gx1, gy1 = geom.bounds
+            c0 = max(int((gx0 - minx) / self.dx), 0)
+            c1 = min(int(np.ceil((gx1 - minx) / self.dx)), self.width)
+            r0 = max(int((maxy - gy1) / self.dy), 0)
+            r1 = min(int(np.ceil((maxy - gy0) / self.dy)), self.height)
+            if c0 >= c1 or r0 >= r1:
+                continue
+
+            # Test vectorisé des centres de pixels : contains_xy exclut les trous,
+            # donc une enclave n'est pas recouverte par la commune qui l'entoure.
+            grid_x, grid_y = np.meshgrid(xs[c0:c1], ys[r0:r1])
+            inside = shapely.contains_xy(geom, grid_x, grid_y)
+            labels[r0:r1, c0:c1][inside] = label
+
+        return labels
+
+    def load_labels(self) -> np.ndarray:
+        """Charger la grille de labels depuis le cache, ou la construire puis la sauvegarder."""
+        if self.labels is not None:
+            return self.labels
+
+        cache_path = self._cache_path()
+        if os.path.exists(cache_path):
+            cached = np.load(cache_path, allow_pickle=False)
+            # Le cache n'est valable que pour le même découpage, la même emprise et la même projection
+            if (
+                np.array_equal(cached["codes"], self.codes.astype(str))
+                and np.allclose(cached["bounds"], self.bounds)
+                and str(cached["crs"]) == self.crs
+            ):
+                self.labels = cached["labels"]
+                return self.labels
+
+        self.labels = self._rasterize()
+        os.makedirs(self.cache_dir, exist_ok=True)
+        np.savez_compressed(
+            cache_path,
+            labels=self.labels,
+            codes=self.codes.astype(str),
+            bounds=np.asarray(self.bounds),
+            crs=np.asarray(self.crs)
+        )
+        return self.labels
+
+    def render(
+        self,
+        data: pd.DataFrame,
+        column: str,
+        output_path: str,
+        cmap="Blues",
+        missing_color="lightgrey",
+        background_color=(1.0, 1.0, 1.0, 0.0)
+    ):
+        """
+        Colorer chaque pixel selon la valeur de sa commune et écrire l'image en PNG.
+
+        :param data: DataFrame contenant la colonne du code commune et la colonne à afficher.
+        :param column: Colonne à représenter.
+        :param output_path: Chemin du fichier PNG généré.
+        :param cmap: Palette matplotlib.
+        :param missing_color: Couleur des communes sans donnée.
+        :param background_color: Couleur des pixels hors commune (transparent par défaut).
+        """
+        labels = self.load_labels()
+
+        deduped = data.drop_duplicates(subset=self.code_column)
+        series = pd.Series(
+            deduped[column].to_numpy(),
+            index=deduped[self.code_column].astype(str).str.zfill(5)
+        )
+        values = pd.to_numeric(series, errors="coerce").reindex(self.codes).to_numpy(dtype=float)
+
+        missing = np.isnan(values)
+        if missing.all():
+            norm = Normalize(0.0, 1.0)
+        else:
+            norm = Normalize(np.nanmin(values), np.nanmax(values))
+        colors = plt.get_cmap(cmap)(norm(np.where(missing, 0.0, values)))
+        colors[missing] = to_rgba(missing_color)
+
+        # Table de couleurs en uint8 : l'image indexée fait H×W×4 octets au lieu de flottants.
+        # Le label -1 (hors commune) indexe la dernière ligne : le fond.
+        lut = np.vstack([colors, to_rgba(background_color)])
+        lut = (lut * 255).round().astype(np.uint8)
+        plt.imsave(output_path, lut[labels])
+
+
+# ============================
+# Vérification : trous et enclaves
+# ============================
+if __name__ == "__main__":
+    import tempfile
+    from shapely.geometry import Polygon, box
+
+    # Enclave listée avant la commune qui l'entoure : elle ne doit pas être recouverte
+    enclave = box(3, 3, 7, 7)
+    surrounding = Polygon([(0, 0), (10, 0), (10, 10), (0, 10)], [enclave.exterior.coords])
+    communes = gpd.GeoDataFrame({"codgeo": ["00001", "00002"]}, geometry=[enclave, surrounding])
+
+    with tempfile.TemporaryDirectory() as cache_dir:
+        renderer = RasterMapRenderer(communes, width=100, cache_dir=cache_dir)
+        labels = renderer.load_labels()
+
+    enclave_pixels = (labels == 0).sum()
+    surrounding_pixels = (labels == 1).sum()
+    assert enclave_pixels == 40 * 40, enclave_pixels
+    assert surrounding_pixels == 100 * 100 - 40 * 40, surrounding_pixels
+    print(f"OK : enclave {enclave_pixels} pixels, commune englobante {surrounding_pixels} pixels.")